@@ -1,5 +1,19 @@
+import bisect
+import multiprocessing
+from array import array
+
 from tqdm import tqdm
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# maps '#' to 1 and every other character to 0
+OBSTACLE_TABLE = bytes(1 if c == ord('#') else 0 for c in range(256))
+# grid value for the border cells around a padded map, see Maze.hit_tables
+EDGE = 2
+
 class Maze(object):
     OFFSETS = [
         (-1, 0), # up
@@ -12,6 +26,9 @@ class Maze(object):
         self.width = len(lines[0])
         self.height = len(lines)
         self.start = None
+        # (row, col, dir_idx) for every step of the unobstructed walk, filled in by run()
+        self.path = None
+        self.first_visit = None
 
         for row, l in enumerate(lines):
             if '^' in l:
@@ -19,6 +36,19 @@ class Maze(object):
         if not self.start:
             raise ValueError('missing start')
 
+        # jump tables: sorted obstacle columns for each row, sorted obstacle rows for each column
+        self.row_obstacles = {}
+        self.col_obstacles = {}
+        for row, l in enumerate(lines):
+            col = l.find('#')
+            while col != -1:
+                self.row_obstacles.setdefault(row, []).append(col)
+                self.col_obstacles.setdefault(col, []).append(row)
+                col = l.find('#', col + 1)
+
+    def is_empty(self, row, col):
+        return self.lines[row][col] == '.'
+
     def is_valid(self, row, col):
         if row < 0 or row >= self.height:
             return False
@@ -26,77 +56,342 @@ class Maze(object):
             return False
         return True
 
+    def next_stop(self, row, col, dir_idx, obs=None):
+        """
+        Returns the cell the guard stops on when walking from (row, col) facing dir_idx, i.e. the cell just
+        before the next obstacle, or None if the guard walks out of the maze instead. If obs is given as a
+        (row, col) tuple, it's treated as one extra obstacle.
+        """
+        if dir_idx % 2 == 0:
+            # moving up or down, so only the obstacles in this column matter
+            pos = row
+            obstacles = self.col_obstacles.get(col, ())
+            obs_pos = obs[0] if obs and obs[1] == col else None
+        else:
+            pos = col
+            obstacles = self.row_obstacles.get(row, ())
+            obs_pos = obs[1] if obs and obs[0] == row else None
+
+        if dir_idx in (0, 3):
+            # moving up or left, towards smaller indexes
+            i = bisect.bisect_left(obstacles, pos)
+            hit = obstacles[i - 1] if i else None
+            if obs_pos is not None and obs_pos < pos and (hit is None or obs_pos > hit):
+                hit = obs_pos
+            if hit is None:
+                return None
+            stop = hit + 1
+        else:
+            i = bisect.bisect_right(obstacles, pos)
+            hit = obstacles[i] if i < len(obstacles) else None
+            if obs_pos is not None and obs_pos > pos and (hit is None or obs_pos < hit):
+                hit = obs_pos
+            if hit is None:
+                return None
+            stop = hit - 1
+
+        if dir_idx % 2 == 0:
+            return stop, col
+        return row, stop
+
+    def hit_tables(self):
+        """
+        Returns (stride, grid, hits) for the map padded with a border of EDGE cells, where cells are
+        flat indexes row * stride + col into the padded map. hits[dir_idx][idx] is the obstacle or edge
+        cell the guard walks into from idx facing dir_idx, so a whole jump is a single lookup.
+        """
+        stride = self.width + 2
+        size = stride * (self.height + 2)
+        grid = bytearray([EDGE]) * size
+        hits = [array('i', bytes(4 * size)) for _ in range(4)]
+        up, right, down, left = hits
+
+        for row in range(self.height):
+            base = (row + 1) * stride
+            grid[base + 1:base + 1 + self.width] = self.lines[row].encode().translate(OBSTACLE_TABLE)
+            # every run of empty cells between two obstacles (or edges) shares the same left and right hits
+            cols = [0] + [col + 1 for col in self.row_obstacles.get(row, ())] + [self.width + 1]
+            for a, b in zip(cols, cols[1:]):
+                if b - a > 1:
+                    left[base + a + 1:base + b] = array('i', [base + a]) * (b - a - 1)
+                    right[base + a + 1:base + b] = array('i', [base + b]) * (b - a - 1)
+
+        for col in range(self.width):
+            rows = [0] + [row + 1 for row in self.col_obstacles.get(col, ())] + [self.height + 1]
+            for a, b in zip(rows, rows[1:]):
+                if b - a > 1:
+                    cells = slice((a + 1) * stride + col + 1, b * stride + col + 1, stride)
+                    up[cells] = array('i', [a * stride + col + 1]) * (b - a - 1)
+                    down[cells] = array('i', [b * stride + col + 1]) * (b - a - 1)
+        return stride, grid, hits
+
+    def distance_to_edge(self, row, col, dir_idx):
+        return [row, self.width - 1 - col, self.height - 1 - row, col][dir_idx]
+
     def run(self):
         row, col = self.start
         visited = set()
+        visited.add((row, col))
         dir_idx = 0 # up
+        path = [(row, col, dir_idx)]
 
         while True:
-            visited.add((row, col))
+            stop = self.next_stop(row, col, dir_idx)
+            if stop is None:
+                steps = self.distance_to_edge(row, col, dir_idx)
+            else:
+                steps = abs(stop[0] - row) + abs(stop[1] - col)
+
+            # jump to the next obstacle, marking every cell we pass over
             r_off, c_off = self.OFFSETS[dir_idx]
-            n_row, n_col = row + r_off, col + c_off
+            for i in range(1, steps + 1):
+                visited.add((row + i * r_off, col + i * c_off))
+                path.append((row + i * r_off, col + i * c_off, dir_idx))
+            row, col = row + steps * r_off, col + steps * c_off
 
-            # if next move would leave the maze, we're done
-            if not self.is_valid(n_row, n_col):
+            # if we didn't hit anything, we walked out of the maze
+            if stop is None:
                 break
-
-            # check for an obstacle
-            while self.lines[n_row][n_col] == '#':
-                dir_idx = (dir_idx + 1) % 4
-                r_off, c_off = self.OFFSETS[dir_idx]
-                n_row, n_col = row + r_off, col + c_off
-
-            row, col = n_row, n_col
+            dir_idx = (dir_idx + 1) % 4
         print(f'exited the maze at {row} {col}, visited {len(visited)}')
+        self.set_path(path)
         return visited
 
+    def set_path(self, path):
+        """
+        Stores the walk recorded by run() and indexes where it first reaches each cell
+        """
+        first_visit = {}
+        for idx, (row, col, dir_idx) in enumerate(path):
+            first_visit.setdefault((row, col), idx)
+        self.path = path
+        self.first_visit = first_visit
+
+    def get_resume_state(self, obs_row, obs_col):
+        """
+        Returns the (row, col, dir_idx) the guard is in just before it first walks into (obs_row, obs_col).
+        Up to that point, an obstacle there makes no difference, so a loop check can start from here.
+        """
+        idx = self.first_visit.get((obs_row, obs_col)) if self.first_visit else None
+        if not idx:
+            return self.start + (0,)
+        row, col, _ = self.path[idx - 1]
+        return row, col, self.path[idx][2]
+
     def does_create_loop(self, obs_row, obs_col):
         """
-        Returns True if adding a loop at (row, col) will create a loop
+        Returns True if adding an obstacle at (row, col) will create a loop
         """
-        row, col = self.start
-        dir_idx = 0 # up
+        if not self.is_empty(obs_row, obs_col):
+            raise ValueError(f'({obs_row}, {obs_col}) is not empty')
+
+        row, col, dir_idx = self.get_resume_state(obs_row, obs_col)
+        obs = (obs_row, obs_col)
+
+        # we only jump between obstacles, so it's enough to remember where we turned
         loop_check = set()
-        loop_check.add((row, col, dir_idx))
 
         while True:
-            if self.lines[obs_row][obs_col] != '.':
-                print(obs_row, obs_col, self.lines[obs_row][obs_col])
-                sys.exit()
-            r_off, c_off = self.OFFSETS[dir_idx]
-            n_row, n_col = row + r_off, col + c_off
-
-            if not self.is_valid(n_row, n_col):
+            stop = self.next_stop(row, col, dir_idx, obs)
+            if stop is None:
                 return False
 
-            # if we've already been to the next cell while facing the current direction,
-            # we're in a loop
-            if (n_row, n_col, dir_idx) in loop_check:
+            row, col = stop
+            # if we've already turned here while facing the same direction, we're in a loop
+            state = (row * self.width + col) * 4 + dir_idx
+            if state in loop_check:
                 return True
+            loop_check.add(state)
+            dir_idx = (dir_idx + 1) % 4
 
-            # keep turning until we dont have an obstacle in front of us
-            while self.lines[n_row][n_col] == '#' or (obs_row, obs_col) == (n_row, n_col):
-                dir_idx = (dir_idx + 1) % 4
-                r_off, c_off = self.OFFSETS[dir_idx]
-                n_row, n_col = row + r_off, col + c_off
+    def part2(self, visited, workers=1, chunk_size=256):
+        """
+        Counts the cells where a new obstacle would trap the guard in a loop. With workers > 1 the candidate
+        cells are split into chunks and checked by a process pool.
+        """
+        candidates = sorted(cell for cell in visited if cell != self.start)
+        if workers <= 1:
+            acc = 0
+            for row, col in tqdm(candidates):
+                if self.does_create_loop(row, col):
+                    acc += 1
+            return acc
 
-            loop_check.add((n_row, n_col, dir_idx))
-            row, col = n_row, n_col
+        chunks = [candidates[i:i + chunk_size] for i in range(0, len(candidates), chunk_size)]
+        counts = [0] * len(chunks)
+        # each worker builds its own copy of the maze once, so tasks only carry their candidate cells
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(type(self), self.lines, self.path)) as pool:
+            with tqdm(total=len(candidates)) as progress:
+                for chunk_idx, count, checked in pool.imap_unordered(_count_loops, enumerate(chunks)):
+                    counts[chunk_idx] = count
+                    progress.update(checked)
+        return sum(counts)
+
+    def part2_batch(self, visited, batch_size=4096):
+        """
+        Same count as part2, but the candidates are simulated in numpy batches of batch_size guards that all
+        jump in lockstep, each with its own extra obstacle.
+        """
+        if np is None:
+            raise ImportError('Maze.part2_batch needs numpy')
+
+        tables = self.hit_tables_np()
+        candidates = sorted(cell for cell in visited if cell != self.start)
 
-    def part2(self, visited):
         acc = 0
-        for row, col in tqdm(visited):
-            if (row, col) == self.start:
-                continue
-            if self.does_create_loop(row, col):
-                acc += 1
+        for idx in tqdm(range(0, len(candidates), batch_size)):
+            acc += self.count_loops_batch(tables, candidates[idx:idx + batch_size])
         return acc
 
+    def hit_tables_np(self):
+        """
+        Same as hit_tables, but built with numpy and returned as numpy arrays, hits being (4, cells)
+        """
+        stride = self.width + 2
+        grid = np.full((self.height + 2, stride), EDGE, dtype=np.uint8)
+        grid[1:-1, 1:-1] = np.frombuffer(''.join(self.lines).encode(), dtype=np.uint8).reshape(self.height, self.width) == ord('#')
+        # running max/min of the wall indexes gives the nearest wall at or before/after each cell
+        idx = np.arange(grid.size, dtype=np.int32).reshape(grid.shape)
+        walls = grid != 0
+        before = np.where(walls, idx, np.int32(-1))
+        after = np.where(walls, idx, np.int32(grid.size))
+
+        hits = np.zeros((4,) + grid.shape, dtype=np.int32)
+        hits[0, 1:] = np.maximum.accumulate(before, axis=0)[:-1]
+        hits[1, :, :-1] = np.minimum.accumulate(after[:, ::-1], axis=1)[:, ::-1][:, 1:]
+        hits[2, :-1] = np.minimum.accumulate(after[::-1], axis=0)[::-1][1:]
+        hits[3, :, 1:] = np.maximum.accumulate(before, axis=1)[:, :-1]
+        return stride, grid.ravel(), hits.reshape(4, -1)
+
+    def count_loops_batch(self, tables, cells):
+        """
+        Returns how many of the obstacle cells in a batch trap the guard. tables comes from hit_tables_np. Every guard (lane) jumps to its next turn once per iteration, and retires when it walks off
+        the map or repeats a state. Repeats are found with Brent's cycle detection, so each lane only has to
+        remember a single earlier state.
+        """
+        stride, grid, hits = tables
+        steps = np.array([-stride, 1, stride, -1])
+
+        # one column per lane: padded position, heading, obstacle, and the cycle detection bookkeeping
+        lanes = np.zeros((6, len(cells)), dtype=np.int64)
+        pos, dir_idx, obs, saved, power, lam = range(6)
+        resume = np.array([self.get_resume_state(*cell) for cell in cells]).T
+        lanes[pos] = (resume[0] + 1) * stride + resume[1] + 1
+        lanes[dir_idx] = resume[2]
+        obs_cells = np.array(cells).T
+        lanes[obs] = (obs_cells[0] + 1) * stride + obs_cells[1] + 1
+        lanes[saved] = -1
+        lanes[power] = 1
+
+        loops = 0
+        while lanes.shape[1]:
+            hit = hits[lanes[dir_idx], lanes[pos]]
+            # same check as CompactMaze.does_create_loop: is the lane's obstacle between it and the hit
+            between = (np.minimum(hit, lanes[pos]) < lanes[obs]) & (lanes[obs] < np.maximum(hit, lanes[pos]))
+            in_line = (lanes[dir_idx] & 1 == 1) | ((lanes[pos] - lanes[obs]) % stride == 0)
+            blocked = between & in_line
+            hit = np.where(blocked, lanes[obs], hit)
+
+            inside = blocked | (grid[hit] != EDGE)
+            if not inside.all():
+                lanes, hit = lanes[:, inside], hit[inside]
+
+            lanes[pos] = hit - steps[lanes[dir_idx]]
+            state = lanes[pos] * 4 + lanes[dir_idx]
+            lanes[dir_idx] = (lanes[dir_idx] + 1) % 4
+
+            looped = state == lanes[saved]
+            lanes[lam] += 1
+            reset = lanes[lam] == lanes[power]
+            lanes[saved] = np.where(reset, state, lanes[saved])
+            lanes[power] = np.where(reset, lanes[power] * 2, lanes[power])
+            lanes[lam] = np.where(reset, 0, lanes[lam])
+
+            if looped.any():
+                loops += int(np.count_nonzero(looped))
+                lanes = lanes[:, ~looped]
+        return loops
+
+class StateBitset(object):
+    """
+    Buffer for a fixed-size bitset of (cell, direction) states. Whoever sets bits in bits records the byte
+    in touched, so clear() only zeroes those and reusing it between loop checks costs O(states added)
+    rather than O(maze size).
+    """
+    def __init__(self, size):
+        self.bits = bytearray((size + 7) // 8)
+        self.touched = []
+
+    def clear(self):
+        for byte_idx in self.touched:
+            self.bits[byte_idx] = 0
+        self.touched = []
+
+class CompactMaze(Maze):
+    """
+    Maze that keeps the map as a flat padded bytearray with precomputed hit tables (see hit_tables), and
+    tracks loop check states in one reusable bitset, i.e. 4 bits per cell, instead of a fresh set per check.
+    Loop checks only do flat index arithmetic, no tuples, bisects or hashing.
+    """
+    def __init__(self, lines):
+        super().__init__(lines)
+        self.stride, self.grid, self.hits = self.hit_tables()
+        self.states = StateBitset(len(self.grid) * 4)
+
+    def is_empty(self, row, col):
+        return not self.grid[(row + 1) * self.stride + col + 1] and (row, col) != self.start
+
+    def does_create_loop(self, obs_row, obs_col):
+        if not self.is_empty(obs_row, obs_col):
+            raise ValueError(f'({obs_row}, {obs_col}) is not empty')
+
+        row, col, dir_idx = self.get_resume_state(obs_row, obs_col)
+        stride, grid, hits = self.stride, self.grid, self.hits
+        steps = (-stride, 1, stride, -1)
+        pos = (row + 1) * stride + col + 1
+        obs = (obs_row + 1) * stride + obs_col + 1
+        # the bitset is worked on directly, method calls would cost more than the lookups themselves
+        self.states.clear()
+        bits, touched = self.states.bits, self.states.touched
+
+        while True:
+            hit = hits[dir_idx][pos]
+            # the new obstacle gets in the way if it's between us and the hit. moving sideways, everything
+            # in between is on our row, but moving up or down it also has to be in our column
+            if (hit < obs < pos or pos < obs < hit) and (dir_idx & 1 or (pos - obs) % stride == 0):
+                hit = obs
+            elif grid[hit] == EDGE:
+                return False
+
+            pos = hit - steps[dir_idx]
+            state = pos * 4 + dir_idx
+            byte_idx = state >> 3
+            bit = 1 << (state & 7)
+            if bits[byte_idx] & bit:
+                return True
+            bits[byte_idx] |= bit
+            touched.append(byte_idx)
+            dir_idx = (dir_idx + 1) % 4
+
+# the maze owned by the current pool worker, see Maze.part2
+_worker_maze = None
+
+def _init_worker(maze_cls, lines, path):
+    global _worker_maze
+    _worker_maze = maze_cls(lines)
+    if path:
+        _worker_maze.set_path(path)
+
+def _count_loops(task):
+    chunk_idx, cells = task
+    count = sum(1 for row, col in cells if _worker_maze.does_create_loop(row, col))
+    return chunk_idx, count, len(cells)
+
 def main():
     with open('input/day6_input.txt', 'r') as f:
         m = Maze([l.strip() for l in f.readlines()])
         visited = m.run()
-        print(m.part2(visited))
+        print(m.part2(visited, workers=multiprocessing.cpu_count()))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,148 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import random
+import sys
+import time
+import tracemalloc
+
+from day06 import Maze, CompactMaze
+
+# how part2 gets run for each backend name
+BACKENDS = {
+    'maze': (Maze, lambda m, visited: m.part2(visited)),
+    'compact': (CompactMaze, lambda m, visited: m.part2(visited)),
+    'pool': (CompactMaze, lambda m, visited: m.part2(visited, workers=multiprocessing.cpu_count())),
+    'batch': (Maze, lambda m, visited: m.part2_batch(visited)),
+}
+
+def generate_map(height, width, density, loop_propensity, seed=0):
+    """
+    Returns the lines of a random guard map. density is the fraction of cells holding an obstacle, and
+    loop_propensity is the number of near-loops per 10k cells: three corners of a rectangle the guard
+    would circle forever, so a single extra obstacle closes the loop.
+    """
+    rnd = random.Random(seed)
+    rows = [bytearray(b'.' * width) for _ in range(height)]
+
+    obstacle_count = int(height * width * density)
+    for _ in range(obstacle_count):
+        rows[rnd.randrange(height)][rnd.randrange(width)] = ord('#')
+
+    for _ in range(int(height * width * loop_propensity / 10000)):
+        r0 = rnd.randrange(1, height - 3)
+        c0 = rnd.randrange(1, width - 3)
+        r1 = rnd.randrange(r0 + 1, min(r0 + 20, height - 1))
+        c1 = rnd.randrange(c0 + 1, min(c0 + 20, width - 1))
+        # the obstacles the guard turns at when walking clockwise around (r0, c0) -> (r1, c1)
+        corners = [(r0 - 1, c0), (r0, c1 + 1), (r1 + 1, c1), (r1, c0 - 1)]
+        corners.pop(rnd.randrange(4))
+        for row, col in corners:
+            rows[row][col] = ord('#')
+
+    row, col = rnd.randrange(height), rnd.randrange(width)
+    rows[row][col] = ord('^')
+    return [r.decode() for r in rows]
+
+def guard_escapes(maze):
+    """
+    Returns True if the guard walks out of the maze without any extra obstacles
+    """
+    row, col = maze.start
+    dir_idx = 0
+    seen = set()
+    while True:
+        stop = maze.next_stop(row, col, dir_idx)
+        if stop is None:
+            return True
+        if stop + (dir_idx,) in seen:
+            return False
+        seen.add(stop + (dir_idx,))
+        row, col = stop
+        dir_idx = (dir_idx + 1) % 4
+
+def generate_escapable_map(height, width, density, loop_propensity, seed=0, tries=100):
+    """
+    Same as generate_map, but retries with new seeds until the guard can actually leave
+    """
+    for attempt in range(tries):
+        lines = generate_map(height, width, density, loop_propensity, seed + attempt)
+        if guard_escapes(Maze(lines)):
+            return lines
+    raise ValueError(f'no escapable map after {tries} tries')
+
+def measure(fn):
+    """
+    Returns (result, wall time in seconds, peak traced memory in bytes) for fn. fn gets called twice: once
+    for the time, and once under tracemalloc for the memory, since tracing slows down each backend by a
+    different amount. Memory used by pool workers isn't traced.
+    """
+    start = time.perf_counter()
+    res = fn()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return res, elapsed, peak
+
+def bench(lines, backends, skip_part2=False):
+    results = []
+    for name in backends:
+        maze_cls, part2 = BACKENDS[name]
+        maze = maze_cls(lines)
+        # keep run()'s summary line out of the JSON on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            visited, run_time, run_mem = measure(maze.run)
+        res = {
+            'backend': name,
+            'visited': len(visited),
+            'run_seconds': run_time,
+            'run_peak_bytes': run_mem,
+        }
+        if not skip_part2:
+            loops, part2_time, part2_mem = measure(lambda: part2(maze, visited))
+            res.update({
+                'loops': loops,
+                'part2_seconds': part2_time,
+                'part2_peak_bytes': part2_mem,
+            })
+        results.append(res)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Time day06 Maze backends on generated maps')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 500, 1000])
+    parser.add_argument('--density', type=float, default=0.02)
+    parser.add_argument('--loop-propensity', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--skip-part2', action='store_true')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    report = []
+    for size in args.sizes:
+        gen_start = time.perf_counter()
+        lines = generate_escapable_map(size, size, args.density, args.loop_propensity, args.seed)
+        report.append({
+            'size': size,
+            'density': args.density,
+            'loop_propensity': args.loop_propensity,
+            'seed': args.seed,
+            'generate_seconds': time.perf_counter() - gen_start,
+            'results': bench(lines, args.backends, args.skip_part2),
+        })
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
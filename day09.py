@@ -1,83 +1,294 @@
-import itertools
+import bisect
+import heapq
+import math
 import sys
+import time
 import termcolor
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def extent_checksum(start: int, b_len: int, file_id: int) -> int:
+    """
+    Checksum contribution of b_len blocks of file_id starting at start, i.e.
+    file_id * (start + (start + 1) + ... + (start + b_len - 1))
+    """
+    return file_id * (start * b_len + b_len * (b_len - 1) // 2)
+
 
 class DiskMap(object):
-    def __init__(self, map_str: str):
+    def __init__(self, map_str: str = ''):
         self.map_str = map_str
-        blocks = []
 
+        # tuples of (start_idx, len, file_id), ordered by start_idx
+        self.files = []
         # tuples of (start_idx, len)
-        free_blocks = []
-        free_blocks_remaining = 0
-        file_id = 0
+        self.free_blocks = []
+        self.disk_size = 0
+        # digits parsed so far; even ones are file lengths, odd ones free space lengths
+        self.digits_read = 0
+
+        self.add_digits(map_str)
+
+    @classmethod
+    def from_file(cls, f, chunk_size: int = 1 << 20) -> 'DiskMap':
+        """
+        Builds a DiskMap from anything with a read(n) method returning str or bytes, e.g. an open file or an
+        mmap.mmap. The map is read chunk_size characters at a time, so neither the input nor the expanded
+        disk is ever held in memory.
+        """
+        dm = cls()
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            if isinstance(chunk, bytes):
+                chunk = chunk.decode('ascii')
+            dm.add_digits(chunk.strip())
+        return dm
+
+    def add_digits(self, digits: str) -> None:
+        """
+        Appends more of the map to the disk. The map can be fed in pieces of any size.
+        """
+        files = self.files
+        free_blocks = self.free_blocks
+        disk_size = self.disk_size
+        digit_idx = self.digits_read
+
+        for d in digits:
+            b_len = int(d)
+            if b_len:
+                if digit_idx % 2 == 0:
+                    files.append((disk_size, b_len, digit_idx // 2))
+                elif free_blocks and sum(free_blocks[-1]) == disk_size:
+                    # only a zero-length file since the last free span, so it's really one bigger span
+                    free_start, free_len = free_blocks[-1]
+                    free_blocks[-1] = (free_start, free_len + b_len)
+                else:
+                    free_blocks.append((disk_size, b_len))
+                disk_size += b_len
+            digit_idx += 1
+
+        self.disk_size = disk_size
+        self.digits_read = digit_idx
+
+    @property
+    def free_blocks_remaining(self) -> int:
+        """
+        Number of free blocks that still sit in front of some file block
+        """
+        if not self.files:
+            return 0
+        start, b_len, _ = self.files[-1]
+        return sum(f_len for f_start, f_len in self.free_blocks if f_start < start)
+
+    @property
+    def blocks(self) -> list:
+        """
+        Expands the extents into one entry per block, with None for free blocks. Only use this on small maps.
+        """
+        blocks = [None] * self.disk_size
+        for start, b_len, file_id in self.files:
+            blocks[start:start + b_len] = [file_id] * b_len
+        return blocks
 
-        for vals in itertools.batched(map_str, 2):
-            b_len = int(vals[0])
-            blocks.extend([file_id] * b_len)
-            file_id += 1
+    def segments(self, offset: int = 0, length: int | None = None):
+        """
+        Yields (start_idx, len, file_id) for every run of the disk in order, with file_id None for free space.
+        With offset and length, only the runs overlapping that window are visited, clipped to it.
+        """
+        end = self.disk_size if length is None else min(offset + length, self.disk_size)
+        files = self._extents_in_window(self.files, offset, end)
+        free = ((start, f_len, None) for start, f_len in self._extents_in_window(self.free_blocks, offset, end))
+
+        for start, b_len, file_id in heapq.merge(files, free, key=lambda seg: seg[0]):
+            seg_start = max(start, offset)
+            seg_end = min(start + b_len, end)
+            yield seg_start, seg_end - seg_start, file_id
 
-            if len(vals) == 2 and int(vals[1]):
-                f_len = int(vals[1])
-                free_blocks.append((len(blocks), f_len))
-                blocks.extend([None] * f_len)
-                free_blocks_remaining += f_len
+    @staticmethod
+    def _extents_in_window(extents, offset, end):
+        """
+        Yields the extents (sorted by start_idx) that overlap [offset, end)
+        """
+        idx = max(bisect.bisect_right(extents, offset, key=lambda e: e[0]) - 1, 0)
+        while idx < len(extents) and extents[idx][0] < end:
+            start, b_len = extents[idx][:2]
+            if start + b_len > offset:
+                yield extents[idx]
+            idx += 1
 
-        self.blocks = blocks
+    def rebuild_free_blocks(self) -> None:
+        """
+        Recomputes the free spans from the gaps between file extents, e.g. after the files have moved
+        """
+        free_blocks = []
+        pos = 0
+        for start, b_len, file_id in self.files:
+            if start > pos:
+                free_blocks.append((pos, start - pos))
+            pos = start + b_len
+        if self.disk_size > pos:
+            free_blocks.append((pos, self.disk_size - pos))
         self.free_blocks = free_blocks
-        self.free_blocks_remaining = free_blocks_remaining
 
     def __str__(self) -> str:
-        # first, chunk up the block list
-        groups = [list(group) for key, group in itertools.groupby(self.blocks)]
+        return self.render()
 
+    def render(self, offset: int = 0, length: int | None = None) -> str:
+        """
+        Draws the blocks in [offset, offset + length), one character per digit of the file id and '.' for
+        free space. Only the extents inside the window get looked at, so this is cheap for any window size.
+        """
         c_list = list(termcolor.COLORS.keys())
         c_list.remove('black')
         c_list.remove('grey')
-        c_idx = 0
 
         buf = []
-        for g in groups:
-            if g[0] == None:
-                g_str = '.' * len(g)
-            else:
-                g_str = ''.join([str(i) for i in g])
+        for start, b_len, file_id in self.segments(offset, length):
+            if file_id is None:
+                buf.append('.' * b_len)
+                continue
 
-            b_color = c_list[c_idx]
-            c_idx = (c_idx + 1) % len(c_list)
-            block_str = termcolor.colored(g_str, b_color)
+            # color by file id so a file looks the same in every window
+            b_color = c_list[file_id % len(c_list)]
+            block_str = termcolor.colored(str(file_id) * b_len, b_color)
             buf.append(block_str)
 
         return ''.join(buf)
 
-    def compact_part1(self) -> None:
-        start_idxs = [start for start, free_len in self.free_blocks]
-        free_block_idx = start_idxs.pop(0)
-        src_idx = -1
-
-        # because we delete any trailing free space, this is our exit condition
-        while self.free_blocks_remaining > 0:
-            # print('before', self)
-            # we've exhausted the current free block
-            if self.blocks[free_block_idx] != None:
-                free_block_idx = start_idxs.pop(0)
-
-            dest_contents = self.blocks.pop()
-
-            # tried to move a free space block
-            if not dest_contents:
-                self.free_blocks_remaining -= 1
-                continue
+    def overview(self, width: int = 100) -> str:
+        """
+        Summarizes the whole disk in about width characters. Each character covers an equal number of blocks
+        and shows how full they are, from ' ' (all free) to '█' (all file blocks).
+        """
+        levels = ' ▁▂▃▄▅▆▇█'
+        bucket_size = max(1, -(-self.disk_size // width))
+        bucket_count = -(-self.disk_size // bucket_size)
+        used = [0] * bucket_count
+
+        for start, b_len, file_id in self.files:
+            pos, end = start, start + b_len
+            while pos < end:
+                bucket = pos // bucket_size
+                bucket_end = min(end, (bucket + 1) * bucket_size)
+                used[bucket] += bucket_end - pos
+                pos = bucket_end
+
+        buf = []
+        for bucket, count in enumerate(used):
+            bucket_len = min(bucket_size, self.disk_size - bucket * bucket_size)
+            buf.append(levels[round(count / bucket_len * (len(levels) - 1))])
+        return ''.join(buf)
+
+    def compact_part1(self, progress: bool = False, progress_interval: float = 1.0) -> int:
+        """
+        Moves file blocks from the end of the disk into the leftmost free block until there are no gaps left.
+        This works on whole extents: the tail of the last file fills as much of the leftmost free span as it
+        can, and a file that only partly fits gets split.
+
+        Returns the checksum of the compacted disk, added up as extents are placed. With progress set, prints
+        how far along it is at most once every progress_interval seconds.
+        """
+        remaining = list(self.files)
+        moved = []
+        acc = 0
+        to_move = self.free_blocks_remaining
+        moved_blocks = 0
+        last_report = time.monotonic()
+
+        for free_start, free_len in self.free_blocks:
+            # stop once the free span is past every file block that's left
+            while free_len and remaining and remaining[-1][0] > free_start:
+                start, b_len, file_id = remaining.pop()
+                move_len = min(b_len, free_len)
+                moved.append((free_start, move_len, file_id))
+                acc += extent_checksum(free_start, move_len, file_id)
+                free_start += move_len
+                free_len -= move_len
+                moved_blocks += move_len
+                if move_len < b_len:
+                    remaining.append((start, b_len - move_len, file_id))
+            if not remaining or remaining[-1][0] < free_start:
+                break
+
+            if progress and time.monotonic() - last_report >= progress_interval:
+                print(f'moved {moved_blocks} of at most {to_move} blocks')
+                last_report = time.monotonic()
 
-            # cool, we can do this copy
-            print(f'idx is {free_block_idx} len is {len(self.blocks)} fbs is {self.free_blocks_remaining}')
-            self.blocks[free_block_idx] = dest_contents
-            free_block_idx += 1
-            self.free_blocks_remaining -= 1
+        # whatever didn't move stays where it is
+        for start, b_len, file_id in remaining:
+            acc += extent_checksum(start, b_len, file_id)
+
+        self.files = list(heapq.merge(remaining, moved))
+        self.rebuild_free_blocks()
+        return acc
 
     def compact_part2(self) -> None:
-        pass
+        """
+        Moves whole files, highest file id first, into the leftmost free span that fits them, if that's to
+        the left of where the file is now. Free spans are bucketed by size into min-heaps of their start
+        offsets (with everything as long as the longest file in one last bucket), so finding the leftmost fit
+        only looks at the top of each bucket that's big enough.
+        """
+        files = []
+        for start, new_start, b_len, file_id in self.plan_part2_moves():
+            files.append((new_start, b_len, file_id))
+
+        files.sort()
+        self.files = files
+        self.rebuild_free_blocks()
+
+    def plan_part2_moves(self):
+        """
+        Yields (start_idx, new_start_idx, len, file_id) for every file, in the order compact_part2 moves them.
+        new_start_idx is the same as start_idx for files that stay put.
+        """
+        # spans at least as long as the longest file fit any file, so they all share one heap of (start, len)
+        # and the buckets only go up to the longest file, however big the merged free spans get
+        max_file_len = max((b_len for start, b_len, file_id in self.files), default=0)
+        free_heaps = {}
+        big_spans = []
+        for free_start, free_len in self.free_blocks:
+            if free_len >= max_file_len:
+                big_spans.append((free_start, free_len))
+            else:
+                free_heaps.setdefault(free_len, []).append(free_start)
+        for heap in free_heaps.values():
+            heapq.heapify(heap)
+        heapq.heapify(big_spans)
+
+        for start, b_len, file_id in sorted(self.files, key=lambda f: f[2], reverse=True):
+            best_start, best_len = start, None
+            if big_spans and big_spans[0][0] < best_start:
+                best_start, best_len = big_spans[0]
+            for free_len in range(b_len, max_file_len):
+                heap = free_heaps.get(free_len)
+                if heap and heap[0] < best_start:
+                    best_start, best_len = heap[0], free_len
+
+            # the space this file leaves behind is never used again: every file still to be moved has a
+            # lower id, so it starts further left and only moves left
+            new_start = start
+            if best_len is not None:
+                if best_len >= max_file_len:
+                    heapq.heappop(big_spans)
+                else:
+                    heapq.heappop(free_heaps[best_len])
+                new_start = best_start
+                left_len = best_len - b_len
+                if left_len >= max_file_len:
+                    heapq.heappush(big_spans, (new_start + b_len, left_len))
+                elif left_len:
+                    heapq.heappush(free_heaps.setdefault(left_len, []), new_start + b_len)
+            yield start, new_start, b_len, file_id
+
+    def to_array(self, dtype=None) -> 'DiskArray':
+        return DiskArray(self, dtype)
 
     def get_checksum(self) -> int:
         """
@@ -86,26 +297,78 @@ class DiskMap(object):
         skip it instead.
         """
         acc = 0
-        for block_idx, file_id in enumerate(self.blocks):
-            if not file_id:
-                print('skipping a free block')
-                continue
-            acc += block_idx * file_id
+        for start, b_len, file_id in self.files:
+            acc += extent_checksum(start, b_len, file_id)
+        return acc
+
+class DiskArray(object):
+    """
+    One numpy entry per block of a DiskMap, holding the file id or FREE. Takes about 4 bytes per block with
+    int32 ids, against a pointer per block for a list.
+    """
+    FREE = -1
+
+    def __init__(self, disk_map: DiskMap, dtype=None):
+        if np is None:
+            raise ImportError('DiskArray needs numpy')
+        if dtype is None:
+            dtype = np.int32 if disk_map.digits_read // 2 < 2 ** 31 else np.int64
+
+        self.disk_map = disk_map
+        self.blocks = np.full(disk_map.disk_size, self.FREE, dtype=dtype)
+        for start, b_len, file_id in disk_map.files:
+            self.blocks[start:start + b_len] = file_id
+
+    def compact_part1(self) -> None:
+        """
+        Same result as DiskMap.compact_part1: the k-th free block from the left gets the k-th file block from
+        the right, for every free block that's left of the last file block. Done as one fancy-indexed copy.
+        """
+        file_idxs = np.flatnonzero(self.blocks != self.FREE)
+        holes = np.flatnonzero(self.blocks[:len(file_idxs)] == self.FREE)
+        self.blocks[holes] = self.blocks[file_idxs[::-1][:len(holes)]]
+        self.blocks[len(file_idxs):] = self.FREE
+
+    def compact_part2(self) -> None:
+        """
+        Same result as DiskMap.compact_part2, applying each whole-file move as two slice assignments
+        """
+        for start, new_start, b_len, file_id in self.disk_map.plan_part2_moves():
+            if new_start != start:
+                self.blocks[new_start:new_start + b_len] = file_id
+                self.blocks[start:start + b_len] = self.FREE
+
+    def get_checksum(self, chunk_size: int = 1 << 20) -> int:
+        """
+        Dot product of the file ids (free blocks counted as 0) with their positions, done one chunk at a time
+        so the int64 temporaries stay small. Positions are taken relative to the chunk start, and the chunk is
+        kept short enough for its partial sums to fit in int64. The partial sums get added up as Python ints.
+        """
+        max_id = max(int(self.blocks.max(initial=0)), 1)
+        # a partial sum is at most max_id * chunk_size ** 2 / 2
+        chunk_size = max(1, min(chunk_size, math.isqrt((2 ** 63 - 1) // max_id)))
+        offsets = np.arange(chunk_size, dtype=np.int64)
+
+        acc = 0
+        for start in range(0, len(self.blocks), chunk_size):
+            file_ids = np.maximum(self.blocks[start:start + chunk_size], 0).astype(np.int64)
+            acc += start * int(file_ids.sum()) + int(np.dot(file_ids, offsets[:len(file_ids)]))
         return acc
 
 def main():
     # 6400828038148 is too low
     # 6401092019345
-    with open('input/day9_input.txt', 'r') as f:
-        dm = DiskMap(f.readline().strip())
+    with open('input/day9_input.txt', 'rb') as f:
+        dm = DiskMap.from_file(f)
         # dm = DiskMap('12345')
         # dm = DiskMap('2333133121414131402')
         # print(dm.blocks)
         # print(dm)
-        dm.compact_part1()
+        checksum = dm.compact_part1(progress=True)
         # dm.compact_part2()
-        print(dm)
-        print(dm.get_checksum())
+        # rendering every block of the real input takes forever, the overview is enough to eyeball it
+        print(dm.overview())
+        print(checksum)
         # print(dm)
 
 
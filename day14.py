@@ -1,151 +1,471 @@
-import re
+import hashlib
+import multiprocessing
+import os
+import threading
 from termcolor import colored
-from math import prod
-from collections import defaultdict
+from math import gcd, prod
 from time import sleep
 
+import numpy as np
+
+from textual import work
 from textual.app import App, ComposeResult
-from textual.widgets import Footer, Header, Static, Button
-from textual.containers import Container, Horizontal
+from textual.widgets import Footer, Header, Static, Button, Input
+from textual.containers import Container, Horizontal, Vertical
+from textual.worker import get_current_worker
 
 class MapApp(App):
-    def __init__(self, map):
+    """
+    Runs the simulation in a worker thread, as fast as ticks_per_second allows (0 for no limit), and
+    redraws the map at most fps times a second from whatever state the simulation has reached. Only the
+    rows that changed since the last redraw get sent to the screen.
+    """
+    CSS = """
+    #controls {
+        height: auto;
+    }
+
+    #skip-input {
+        width: 20;
+    }
+
+    #steps-view, #error-view {
+        width: auto;
+        padding: 1 2;
+    }
+    """
+
+    def __init__(self, map, fps=30, ticks_per_second=60):
         super().__init__()
         self.map = map
+        self.fps = fps
+        self.ticks_per_second = ticks_per_second
+        # guards self.map, which the simulation worker and the UI both touch
+        self.map_lock = threading.Lock()
+        self.shown_rows = []
+        self.row_views = []
 
     def on_mount(self) -> None:
         """Event handler called when widget is added to the app."""
-        self.update_timer = self.set_interval(1 / 60, self.step_forward, pause=False)
-
-    def render(self):
-        return Text("Steps:"+ self.map.total_steps + "\n" + self.map.get_state())
+        self.row_views = list(self.query(".map-row"))
+        self.update_timer = self.set_interval(1 / self.fps, self.refresh_frame, pause=False)
+        self.simulate()
 
     def compose(self) -> ComposeResult:
         """Create the UI components."""
         yield Header()
         yield Footer()
 
+        self.shown_rows = self.map.get_state().splitlines()
         yield Container(
             Horizontal(
                 Button("Step", id="step-button", variant="primary"),
-                Static(self.map.get_state(), id="output-view")))
+                Input(placeholder="Ticks to skip", id="skip-input"),
+                Button("Skip", id="skip-button", variant="primary"),
+                Static(f"Steps: {self.map.total_steps}", id="steps-view"),
+                Static(id="error-view"),
+                id="controls"),
+            Vertical(
+                *[Static(row, classes="map-row") for row in self.shown_rows],
+                id="output-view"))
+
+    @work(thread=True, exclusive=True)
+    def simulate(self) -> None:
+        worker = get_current_worker()
+        while not worker.is_cancelled:
+            with self.map_lock:
+                self.map.step()
+            if self.ticks_per_second:
+                sleep(1 / self.ticks_per_second)
+
+    def refresh_frame(self) -> None:
+        """
+        Shows the latest state of the simulation, updating only the rows that changed
+        """
+        with self.map_lock:
+            total_steps = self.map.total_steps
+            rows = self.map.get_state().splitlines()
+
+        self.query_one("#steps-view").update(f"Steps: {total_steps}")
+        for row_idx, row in enumerate(rows):
+            if row != self.shown_rows[row_idx]:
+                self.row_views[row_idx].update(row)
+        self.shown_rows = rows
 
     def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id == 'step-button':
             self.step_forward(1)
+        elif event.button.id == 'skip-button':
+            self.skip_ticks()
 
-    def step_forward(self, steps=1):
+    def on_input_submitted(self, event: Input.Submitted) -> None:
+        if event.input.id == 'skip-input':
+            self.skip_ticks()
+
+    def skip_ticks(self):
         try:
-            self.map.step(steps)
-            output_str = "Steps: {}\n".format(self.map.total_steps) + self.map.get_state()
-            self.query_one("#output-view").update(output_str)
+            self.step_forward(int(self.query_one("#skip-input").value))
+            self.query_one("#error-view").update("")
         except ValueError:
-            self.handle_execution_error("Invalid register input")
+            self.handle_execution_error("Invalid tick count")
+
+    def step_forward(self, steps=1):
+        # step() is closed form, so skipping any number of ticks costs the same as one
+        with self.map_lock:
+            self.map.step(steps)
+        self.refresh_frame()
 
     def handle_execution_error(self, error):
         """Display an error message (e.g., in a popup or a dedicated area)."""
-        self.query_one("#output-view").update(f"Error: {error}")
+        self.query_one("#error-view").update(f"Error: {error}")
         # self.disable_buttons()
 
 class BathroomMap(object):
     def __init__(self, bot_specs, width, height):
-        self.bot_specs = bot_specs
+        """
+        bot_specs is a list of dicts with r_pos, c_pos, r_vel and c_vel keys, one per robot. They're stored
+        as one numpy array per field rather than one dict per robot.
+        """
         self.width = width
         self.height = height
-        self.row_map = None
         self.total_steps = 0
+        self.set_bots(
+            [s['r_pos'] for s in bot_specs],
+            [s['c_pos'] for s in bot_specs],
+            [s['r_vel'] for s in bot_specs],
+            [s['c_vel'] for s in bot_specs])
+
+    @classmethod
+    def from_arrays(cls, r_pos, c_pos, r_vel, c_vel, width, height):
+        bm = cls([], width, height)
+        bm.set_bots(r_pos, c_pos, r_vel, c_vel)
+        return bm
+
+    @classmethod
+    def from_file(cls, path, width, height, cache_dir=None, chunk_size=1 << 24):
+        """
+        Loads robots from an input file of 'p=c,r v=c,r' lines. The file is read chunk_size bytes at a time
+        and every integer in a chunk is parsed in one numpy call. The parsed array gets cached as a .npy
+        file in cache_dir (.cache in the working directory by default, so not inside the input tree), named
+        after a hash of the input, so loading the same input again skips the parsing. Only the newest cache
+        for each input file is kept.
+        """
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while chunk := f.read(chunk_size):
+                digest.update(chunk)
+
+        if cache_dir is None:
+            cache_dir = '.cache'
+        cache_name = f'{os.path.basename(path)}.{digest.hexdigest()[:16]}.npy'
+        cache_path = os.path.join(cache_dir, cache_name)
+
+        if os.path.exists(cache_path):
+            bots = np.load(cache_path)
+        else:
+            bots = parse_bots(path, chunk_size)
+            os.makedirs(cache_dir, exist_ok=True)
+            # the input changed, so the caches of its older versions will never be hit again
+            for name in os.listdir(cache_dir):
+                if name.startswith(f'{os.path.basename(path)}.') and name.endswith('.npy') and len(name) == len(cache_name):
+                    os.remove(os.path.join(cache_dir, name))
+            np.save(cache_path, bots)
+
+        # columns are c_pos, r_pos, c_vel, r_vel, in input order
+        return cls.from_arrays(bots[:, 1], bots[:, 0], bots[:, 3], bots[:, 2], width, height)
+
+    def set_bots(self, r_pos, c_pos, r_vel, c_vel):
+        self.r_pos = np.asarray(r_pos, dtype=np.int64) % self.height
+        self.c_pos = np.asarray(c_pos, dtype=np.int64) % self.width
+        # velocities only matter modulo the map size, and keeping them small keeps step(n) from overflowing
+        self.r_vel = np.asarray(r_vel, dtype=np.int64) % self.height
+        self.c_vel = np.asarray(c_vel, dtype=np.int64) % self.width
+        self.update_counts()
+
+    def update_counts(self):
+        """
+        Rebuilds the occupancy grid (robots per cell) and the per-row and per-column robot counts after the
+        robots move
+        """
+        cells = np.bincount(self.r_pos * self.width + self.c_pos, minlength=self.height * self.width)
+        self.grid = cells.reshape(self.height, self.width)
+        self.row_counts = self.grid.sum(axis=1)
+        self.col_counts = self.grid.sum(axis=0)
+        self.sat = summed_area_table(self.grid)
+
+    def region_count(self, r_start, r_end, c_start, c_end):
+        """
+        Returns the number of robots in rows [r_start, r_end) and columns [c_start, c_end)
+        """
+        sat = self.sat
+        return int(sat[r_end, c_end] - sat[r_start, c_end] - sat[r_end, c_start] + sat[r_start, c_start])
 
     def get_state(self, highlight=None):
         if not highlight:
             highlight = set()
-        buf = ''
-        for r in range(self.height):
-            for c in range(self.width):
-                bot_count = self.bot_count(r, c)
-                char = None
-                if bot_count > 0:
-                    char = str(bot_count)
-                else:
-                    char = '.'
-
-                if (r, c) in highlight:
-                    char = colored(char, "red")
-                buf += char
-            buf += '\n'
-        return buf
+
+        # look up every cell's character at once: '.' for empty cells, otherwise the robot count
+        chars = np.array(['.'] + [str(i) for i in range(1, self.grid.max() + 1)], dtype=object)
+        cells = chars[self.grid]
+        for r, c in highlight:
+            cells[r, c] = colored(cells[r, c], "red")
+        return ''.join(''.join(row) + '\n' for row in cells)
 
     def bot_count(self, row, col):
         """
         Returns the number of bots present at a given location
         """
-        acc = 0
-        for s in self.bot_specs:
-            if s['r_pos'] == row and s['c_pos'] == col:
-                acc += 1
-        return acc
+        return int(self.grid[row, col])
 
     def get_row_bot_count(self, row):
-        if self.row_map:
-            return self.row_map[row]
-        return len([s for s in self.bot_specs if s['r_pos'] == row])
+        return int(self.row_counts[row])
+
+    def get_col_bot_count(self, col):
+        return int(self.col_counts[col])
 
     def step(self, step_count=1):
-        row_map = defaultdict(int)
-        for s in self.bot_specs:
-            new_row = (s['r_pos'] + (step_count * s['r_vel'])) % self.height
-            new_col = (s['c_pos'] + (step_count * s['c_vel'])) % self.width
-            s['r_pos'] = new_row
-            s['c_pos'] = new_col
-            row_map[new_row] += 1
-        self.row_map = row_map
+        """
+        Moves every robot step_count ticks at once. Positions wrap around the map, so this is just
+        pos + step_count * vel, modulo the map size.
+        """
+        r_steps = step_count % self.height
+        c_steps = step_count % self.width
+        self.r_pos = (self.r_pos + r_steps * self.r_vel) % self.height
+        self.c_pos = (self.c_pos + c_steps * self.c_vel) % self.width
+        self.update_counts()
         self.total_steps += step_count
 
-    def get_safety_factor(self):
+    def get_quadrants(self):
         # correct boundaries for 7 x 11:
         # 0, 3, 0, 5
-        quad_boundaries = [
+        return [
             #r_start,              r_end,            c_start,             c_end
             (0,                    self.height // 2, 0,                   self.width // 2), # ▟
             (0,                    self.height // 2, self.width // 2 + 1, self.width),      # ▙
             (self.height // 2 + 1, self.height,      0,                   self.width // 2), # ▜
             (self.height // 2 + 1, self.height,      self.width // 2 + 1, self.width)       # ▛
         ]
-        quad_bot_counts = []
-        for r_s, r_e, c_s, c_e in quad_boundaries:
-            # print(r_s, r_e, c_s, c_e)
-            bot_count = 0
-            highlight = set()
-            for row in range(r_s, r_e):
-                for col in range(c_s, c_e):
-                    highlight.add((row, col))
-                    bot_count += self.bot_count(row, col)
-            quad_bot_counts.append(bot_count)
-            # print(self.get_state(highlight=highlight))
-        return prod(quad_bot_counts)
-
-    def xmas_scan(self):
-        while True:
-            if self.total_steps % 1000 == 0:
-                print(self.total_steps)
-            incr_cnt = 0
-            bot_count = -1
-            for row in range(self.height):
-                row_cnt = self.get_row_bot_count(row)
-                if row_cnt > bot_count:
-                    incr_cnt += 1
-                    bot_count = row_cnt
-
-            if incr_cnt > 60:
-                print(steps)
-                print(self.get_state())
-                input("good?")
-
-            self.step()
 
+    def get_safety_factor(self, regions=None):
+        """
+        Product of the robot counts in each (r_start, r_end, c_start, c_end) region, the four quadrants by
+        default
+        """
+        if regions is None:
+            regions = self.get_quadrants()
+        return prod(self.region_count(*region) for region in regions)
+
+    def xmas_search(self, jump=True):
+        """
+        Finds the tick where the robots cluster into a picture without stepping through every frame. Columns
+        repeat every width ticks and rows every height ticks, independently of each other, so each of the
+        width column phases and height row phases is scored on its own by position variance. The tightest
+        column phase and row phase are then combined with the Chinese remainder theorem.
+
+        Returns how many ticks from now the picture shows up; with jump, also steps the map there.
+        """
+        c_phase = self.best_phase(self.c_pos, self.c_vel, self.width)
+        r_phase = self.best_phase(self.r_pos, self.r_vel, self.height)
+        ticks = combine_phases(c_phase, self.width, r_phase, self.height)
+        if jump:
+            self.step(ticks)
+        return ticks
+
+    @staticmethod
+    def best_phase(pos, vel, size):
+        """
+        Returns the tick in range(size) where the positions along one axis have the lowest variance
+        """
+        variances = [((pos + tick * vel) % size).var() for tick in range(size)]
+        return int(np.argmin(variances))
+
+    def score_range(self, metric, start, stop, block_size=None):
+        """
+        Scores every tick in range(start, stop), counted from the current state, without stepping the map.
+        metric is one of the functions in METRICS (or its name): it gets (rows, cols, width, height) where
+        rows and cols hold one row per tick and one column per robot, and returns one score per tick.
+        Ticks are handled block_size at a time to bound memory.
+        """
+        if isinstance(metric, str):
+            metric = METRICS[metric]
+        if block_size is None:
+            block_size = max(1, 10_000_000 // max(1, len(self.r_pos)))
+
+        scores = []
+        for block_start in range(start, stop, block_size):
+            ticks = np.arange(block_start, min(block_start + block_size, stop), dtype=np.int64)[:, None]
+            rows = (self.r_pos + (ticks % self.height) * self.r_vel) % self.height
+            cols = (self.c_pos + (ticks % self.width) * self.c_vel) % self.width
+            scores.append(metric(rows, cols, self.width, self.height))
+        if not scores:
+            return np.array([])
+        return np.concatenate(scores)
+
+    def xmas_scan(self, threshold=60, metric='increasing_rows', workers=1, shard_size=1000):
+        """
+        Scores every tick in one full period (width * height ticks) and returns how many ticks from now the
+        first frame scoring above threshold is, or None if there isn't one. The default metric is the number
+        of rows, top to bottom, that have more robots than every row above them.
+
+        With workers > 1 the period is split into shards of shard_size ticks for a process pool, and metric
+        has to be a name from METRICS or a module-level function so it can be pickled. Workers share the
+        earliest hit found so far and give up on anything past it.
+        """
+        period = self.width * self.height
+        if workers <= 1:
+            scores = self.score_range(metric, 0, period)
+            hits = np.flatnonzero(scores > threshold)
+            if not len(hits):
+                return None
+            return int(hits[0])
+
+        first_hit = multiprocessing.Value('q', -1)
+        bots = (self.r_pos, self.c_pos, self.r_vel, self.c_vel, self.width, self.height)
+        shards = [(start, min(start + shard_size, period), threshold, metric)
+                  for start in range(0, period, shard_size)]
+        with multiprocessing.Pool(workers, initializer=_init_scan_worker, initargs=(bots, first_hit)) as pool:
+            for _ in pool.imap_unordered(_scan_shard, shards):
+                pass
+        if first_hit.value < 0:
+            return None
+        return first_hit.value
+
+
+# maps everything except digits and '-' to a space, so a chunk of input turns into whitespace separated ints
+INT_CHARS_TABLE = bytes(c if chr(c) in '0123456789-' else ord(' ') for c in range(256))
+
+def parse_bots(path, chunk_size=1 << 24):
+    """
+    Returns an (N, 4) int64 array of every robot in the input file, one row of c_pos, r_pos, c_vel, r_vel
+    per line
+    """
+    parts = []
+    leftover = b''
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            chunk = leftover + chunk
+            # only parse whole lines, the rest gets picked up with the next chunk
+            line_end = chunk.rfind(b'\n') + 1
+            chunk, leftover = chunk[:line_end], chunk[line_end:]
+            parts.append(np.fromstring(chunk.translate(INT_CHARS_TABLE), dtype=np.int64, sep=' '))
+    parts.append(np.fromstring(leftover.translate(INT_CHARS_TABLE), dtype=np.int64, sep=' '))
+
+    ints = np.concatenate(parts)
+    if len(ints) % 4:
+        raise ValueError(f'{path} has {len(ints)} numbers, expected 4 per robot')
+    return ints.reshape(-1, 4)
+
+# the robots and the shared earliest hit for the current pool worker, see BathroomMap.xmas_scan
+_worker_bots = None
+_worker_first_hit = None
+
+def _init_scan_worker(bots, first_hit):
+    global _worker_bots, _worker_first_hit
+    _worker_bots = bots
+    _worker_first_hit = first_hit
+
+def _scan_shard(shard):
+    start, stop, threshold, metric = shard
+    # once some other shard found an earlier frame, don't even set up the map
+    first_hit = _worker_first_hit.value
+    if 0 <= first_hit <= start:
+        return None
+
+    bm = BathroomMap.from_arrays(*_worker_bots)
+    # jump straight to the start of the shard
+    bm.step(start)
+
+    block_size = max(1, 1_000_000 // max(1, len(bm.r_pos)))
+    for block_start in range(0, stop - start, block_size):
+        # stop as soon as some other shard already found an earlier frame
+        first_hit = _worker_first_hit.value
+        if 0 <= first_hit <= start + block_start:
+            return None
+
+        scores = bm.score_range(metric, block_start, min(block_start + block_size, stop - start))
+        hits = np.flatnonzero(scores > threshold)
+        if len(hits):
+            tick = start + block_start + int(hits[0])
+            with _worker_first_hit.get_lock():
+                if _worker_first_hit.value < 0 or tick < _worker_first_hit.value:
+                    _worker_first_hit.value = tick
+            return tick
+    return None
+
+def axis_histograms(pos, size):
+    """
+    Returns a (ticks, size) array counting the robots at each position along one axis, for every tick
+    """
+    offsets = np.arange(len(pos), dtype=np.int64)[:, None] * size
+    counts = np.bincount((pos + offsets).ravel(), minlength=len(pos) * size)
+    return counts.reshape(len(pos), size)
+
+def summed_area_table(grids):
+    """
+    Prefix sums over the last two axes, padded with a leading zero row and column, so that sat[..., r, c] is
+    the count in grids[..., :r, :c]
+    """
+    sat = np.zeros(grids.shape[:-2] + (grids.shape[-2] + 1, grids.shape[-1] + 1), dtype=np.int64)
+    sat[..., 1:, 1:] = grids.cumsum(axis=-2).cumsum(axis=-1)
+    return sat
+
+def region_safety_metric(regions):
+    """
+    Returns a metric for score_range that multiplies the robot counts in each (r_start, r_end, c_start,
+    c_end) region. Like safety_factor_metric, each region is counted straight from the positions with a
+    mask, so nothing the size of the map gets built per tick.
+    """
+    def metric(rows, cols, width, height):
+        acc = np.ones(len(rows), dtype=np.int64)
+        for r_s, r_e, c_s, c_e in regions:
+            inside = (rows >= r_s) & (rows < r_e) & (cols >= c_s) & (cols < c_e)
+            acc *= np.count_nonzero(inside, axis=1)
+        return acc
+    return metric
+
+def safety_factor_metric(rows, cols, width, height):
+    top, bottom = rows < height // 2, rows > height // 2
+    left, right = cols < width // 2, cols > width // 2
+    quads = [top & left, top & right, bottom & left, bottom & right]
+    return prod(np.count_nonzero(q, axis=1).astype(np.int64) for q in quads)
+
+def entropy(hist):
+    p = hist / np.maximum(hist.sum(axis=1, keepdims=True), 1)
+    return -(p * np.log2(np.where(p > 0, p, 1))).sum(axis=1)
+
+def row_entropy_metric(rows, cols, width, height):
+    return entropy(axis_histograms(rows, height))
+
+def col_entropy_metric(rows, cols, width, height):
+    return entropy(axis_histograms(cols, width))
+
+def max_row_count_metric(rows, cols, width, height):
+    return axis_histograms(rows, height).max(axis=1)
+
+def increasing_rows_metric(rows, cols, width, height):
+    hist = axis_histograms(rows, height)
+    # a row counts when it beats every row above it; the top row always does
+    prev_max = np.maximum.accumulate(hist, axis=1)[:, :-1]
+    return 1 + np.count_nonzero(hist[:, 1:] > prev_max, axis=1)
+
+METRICS = {
+    'safety_factor': safety_factor_metric,
+    'row_entropy': row_entropy_metric,
+    'col_entropy': col_entropy_metric,
+    'max_row_count': max_row_count_metric,
+    'increasing_rows': increasing_rows_metric,
+}
+
+def combine_phases(a, m, b, n):
+    """
+    Chinese remainder theorem: returns the smallest t >= 0 with t % m == a and t % n == b
+    """
+    if gcd(m, n) != 1:
+        raise ValueError(f'map sizes {m} and {n} need to be coprime')
+    return (a + m * ((b - a) * pow(m, -1, n) % n)) % (m * n)
 
 def main():
 
-    r = re.compile(r'p=(?P<c_pos>\d+),(?P<r_pos>\d+) v=(?P<c_vel>-?\d+),(?P<r_vel>-?\d+)')
     # with open('day14_input_ex.txt', 'r') as f:
     #     specs = []
     #     for l in f.readlines():
@@ -166,15 +486,9 @@ def main():
     f_name = 'input/day14_input.txt'
     (rows, cols) = input_sizes[f_name]
 
-    with open(f_name, 'r') as f:
-        specs = []
-        for l in f.readlines():
-            gs = r.match(l).groupdict()
-            gs = {k: int(v) for k, v in gs.items()}
-            specs.append(gs)
-        bm = BathroomMap(specs, cols, rows)
-        app = MapApp(bm)
-        app.run()
+    bm = BathroomMap.from_file(f_name, cols, rows)
+    app = MapApp(bm)
+    app.run()
 
 
 
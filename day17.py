@@ -1,6 +1,14 @@
+import bisect
 import operator
 import itertools
 import sys
+from collections import deque
+from functools import cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from textual.app import App, ComposeResult
 from textual.widgets import Footer, Header, Static, Button, Input
@@ -57,6 +65,7 @@ class DebuggerApp(App):
     def __init__(self, computer):
         super().__init__()
         self.computer = computer
+        self.computer.enable_history()
         self.instruction_ptr = 0
         self.total_steps = 0
         self.output_buffer = ""
@@ -98,11 +107,14 @@ class DebuggerApp(App):
                 Container(
                     Static(f"Instruction Pointer: {self.instruction_ptr}", id="ip-view"),
                     Static(f"Total Steps: {self.total_steps}", id="steps-view"),
+                    Input(placeholder="Go to step", id="goto-input"),
                     id="info-container"
                 ),
                 id="main-container"
             ),
             Horizontal(
+                Button("Back (10)", id="back-10-button", variant="primary"),
+                Button("Back", id="back-button", variant="primary"),
                 Button("Step", id="step-button", variant="primary"),
                 Button("Step (5)", id="step-5-button", variant="primary"),
                 Button("Step (10)", id="step-10-button", variant="primary"),
@@ -139,6 +151,10 @@ class DebuggerApp(App):
             self.step_forward(5)
         elif event.button.id == "step-10-button":
             self.step_forward(10)
+        elif event.button.id == "back-button":
+            self.step_back(1)
+        elif event.button.id == "back-10-button":
+            self.step_back(10)
         elif event.button.id == "run-button":
             self.run_program()
         elif event.button.id == "reset-button":
@@ -151,32 +167,54 @@ class DebuggerApp(App):
     def on_input_submitted(self, event: Input.Submitted) -> None:
         if event.input.id in ["reg-a-input", "reg-b-input", "reg-c-input"]:
             self.set_registers()
+        elif event.input.id == "goto-input":
+            self.goto_step()
 
     def step_forward(self, steps):
         """Execute one step of the program."""
         try:
             self.computer.run(steps=steps)
-            self.instruction_ptr = self.computer.ptr
-            self.total_steps += steps
-            self.update_ui()
+            self.sync_with_computer()
+        except Exception as e:
+            self.handle_execution_error(e)
 
-            if self.instruction_ptr >= len(self.computer.program):
-                self.disable_buttons()
+    def step_back(self, steps):
+        """Go back to where the program was a number of steps ago."""
+        try:
+            self.computer.step_back(steps)
+            self.sync_with_computer()
+        except Exception as e:
+            self.handle_execution_error(e)
+
+    def goto_step(self):
+        """Jump straight to the step number typed into the go to input, forwards or backwards."""
+        try:
+            self.computer.goto_step(int(self.query_one("#goto-input").value))
+            self.sync_with_computer()
+        except ValueError:
+            self.handle_execution_error("Invalid step number")
         except Exception as e:
             self.handle_execution_error(e)
 
     def run_program(self):
         """Run the program until it terminates."""
         try:
-            steps_to_end = len(self.computer.program) - self.instruction_ptr
             self.computer.run()
-            self.instruction_ptr = self.computer.ptr
-            self.total_steps += steps_to_end // 2
-            self.update_ui()
-            self.disable_buttons()
+            self.sync_with_computer()
         except Exception as e:
             self.handle_execution_error(e)
 
+    def sync_with_computer(self):
+        """Pick up the computer's position after it moved, and only allow stepping forward if it can."""
+        self.instruction_ptr = self.computer.ptr
+        self.total_steps = self.computer.steps_taken
+        self.update_ui()
+
+        if self.instruction_ptr >= len(self.computer.program):
+            self.disable_buttons()
+        else:
+            self.reenable_buttons()
+
     def reset_program(self):
         """Reset the program to its initial state."""
         self.computer.reset()
@@ -194,6 +232,8 @@ class DebuggerApp(App):
             self.computer.reg_a = reg_a
             self.computer.reg_b = reg_b
             self.computer.reg_c = reg_c
+            # history from before the change doesn't lead here anymore
+            self.computer.reset_history()
             self.update_ui()
         except ValueError:
             self.handle_execution_error("Invalid register input")
@@ -299,27 +339,212 @@ class Computer(object):
             6: 'bdv',
             7: 'cdv'
         }
+        # time travel, see enable_history()
+        self.history = None
+        self.checkpoints = None
+        self.checkpoint_interval = None
+
+    def enable_history(self, history_size=10000, checkpoint_interval=1000):
+        """
+        Start recording where the computer has been, so goto_step() can go backwards. Every step gets a
+        compact (steps_taken, ptr, reg_a, reg_b, reg_c, output length) snapshot in a ring buffer of the last
+        history_size steps, and every checkpoint_interval steps also gets a full checkpoint with a copy of
+        the output, which is what lets us go back further than the ring buffer reaches.
+        """
+        self.history = deque(maxlen=history_size)
+        self.checkpoint_interval = checkpoint_interval
+        self.reset_history()
+
+    def reset_history(self):
+        """
+        Forget everything recorded so far and start over from the current state, e.g. after the registers
+        got changed by hand
+        """
+        if self.history is None:
+            return
+        self.history.clear()
+        self.checkpoints = []
+        self._record_step()
+
+    def _record_step(self):
+        state = (self.steps_taken, self.ptr, self.reg_a, self.reg_b, self.reg_c)
+        self.history.append(state + (len(self.output),))
+        if not self.checkpoints or self.steps_taken - self.checkpoints[-1][0] >= self.checkpoint_interval:
+            self.checkpoints.append(state + (list(self.output),))
+
+    def goto_step(self, target):
+        """
+        Moves to the state after target steps. Going forward just runs the program. Going backwards restores
+        the snapshot straight from the ring buffer if it's still there, otherwise restores the nearest
+        checkpoint before target and replays the steps in between.
+        """
+        if self.history is None:
+            raise ValueError('call enable_history() before going back in time')
+        target = max(target, self.checkpoints[0][0])
+        if target == self.steps_taken:
+            return
+        if target > self.steps_taken:
+            self.run(steps=target - self.steps_taken)
+            return
+
+        # the output only ever grows, so a compact snapshot just has to cut it back to the right length
+        idx = target - self.history[0][0]
+        if 0 <= idx < len(self.history) and self.history[idx][0] == target:
+            self.steps_taken, self.ptr, self.reg_a, self.reg_b, self.reg_c, output_len = self.history[idx]
+            del self.output[output_len:]
+        else:
+            cp_idx = bisect.bisect_right(self.checkpoints, target, key=lambda cp: cp[0]) - 1
+            self.steps_taken, self.ptr, self.reg_a, self.reg_b, self.reg_c, output = self.checkpoints[cp_idx]
+            self.output = list(output)
+            self.history.clear()
+            self.history.append((self.steps_taken, self.ptr, self.reg_a, self.reg_b, self.reg_c, len(output)))
+
+        # everything recorded past here gets recorded again when we move forward
+        while self.history[-1][0] > self.steps_taken:
+            self.history.pop()
+        while self.checkpoints[-1][0] > self.steps_taken:
+            self.checkpoints.pop()
+
+        if target > self.steps_taken:
+            self.run(steps=target - self.steps_taken)
+
+    def step_back(self, steps=1):
+        self.goto_step(self.steps_taken - steps)
 
     def run(self, steps=-1):
+        for _ in self.run_iter(steps):
+            pass
+
+    def run_iter(self, steps=-1):
+        """
+        Runs like run(), but yields each value as soon as the program outputs it. The computer is always in
+        a consistent state at a yield, so the caller can stop iterating to pause the program there.
+        """
         while self.ptr < len(self.program):
             op = self.program[self.ptr]
             arg = self.program[self.ptr+1]
+            output_len = len(self.output)
             steps_done = self._execute_instruction(op, arg)
             self.steps_taken += 1
             if steps_done == -1:
                 raise Exception("no match")
             self.ptr += steps_done
+            if self.history is not None:
+                self._record_step()
+
+            if len(self.output) > output_len:
+                yield self.output[-1]
 
             if steps > 0:
                 steps -= 1
                 if not steps:
                     break
 
+    def run_until_mismatch(self, expected):
+        """
+        Runs until the output stops matching expected, or until the program halts. Returns True if the
+        program halted having output exactly expected. Stops right after the first wrong value otherwise,
+        so a bad candidate usually costs one or two loops instead of a whole run.
+        """
+        for value in self.run_iter():
+            idx = len(self.output) - 1
+            if idx >= len(expected) or value != expected[idx]:
+                return False
+        return self.output == list(expected)
+
+    def run_compiled_until_mismatch(self, expected):
+        """
+        Same as run_until_mismatch, through the compiled program
+        """
+        self.run_compiled(expected)
+        return self.ptr >= len(self.program) and self.output == list(expected)
+
+    def run_compiled(self, expected=None):
+        """
+        Runs until the program halts, like run(), but through the Python function compile_program() builds
+        for this program instead of decoding every instruction. If we're stopped in the middle of a block
+        (e.g. after single stepping), the interpreter takes us to the next block boundary first.
+
+        With expected, stops right after the first output that doesn't match it.
+        """
+        def output_matches():
+            return expected is None or self.output == list(expected[:len(self.output)])
+
+        program_fn, leaders = compile_program(tuple(self.program))
+        while self.ptr < len(self.program) and self.ptr not in leaders and output_matches():
+            self.run(steps=1)
+        if self.ptr >= len(self.program) or not output_matches():
+            return
+
+        if expected is not None:
+            # the compiled program only sees its own output, so only pass on what's still to come
+            expected = expected[len(self.output):]
+        self.reg_a, self.reg_b, self.reg_c, self.ptr, output, steps = program_fn(
+            self.reg_a, self.reg_b, self.reg_c, self.ptr, expected)
+        self.output.extend(output)
+        self.steps_taken += steps
+
+    def run_batch(self, reg_a, max_steps=100_000, max_output=None):
+        """
+        Runs this program from the start once for every value in reg_a, keeping the current B and C
+        registers. See run_batch() for what comes back.
+        """
+        return run_batch(self.program, reg_a, self.reg_b, self.reg_c, max_steps, max_output)
+
+    def find_quine_reg_a(self):
+        """
+        Returns the smallest reg_a that makes the program output a copy of itself, keeping the original B
+        and C registers, or None if there isn't one.
+
+        This only handles the usual shape: a single loop ending in 'jnz 0', with one 'out' and one 'adv 3',
+        so each pass outputs one value and drops the low 3 bits of A. The last output then only depends on
+        the top 3 bits of A, the one before it on the top 6 bits, and so on, so A can be built up one octal
+        digit at a time starting from the last output, backtracking whenever a digit can't be extended.
+        """
+        program = self.get_program()
+        op_names = [op_name for line_number, op_name, arg_name, human in program]
+        if self.get_jump_map() != {len(program) - 1: 0}:
+            raise ValueError('program needs to be a single loop that jumps back to the start')
+        if op_names.count('out') != 1 or op_names.count('adv') != 1:
+            raise ValueError('program needs exactly one out and one adv per loop')
+        if [arg_name for line_number, op_name, arg_name, human in program if op_name == 'adv'] != ['3']:
+            raise ValueError('program needs to shift reg_a by 3 bits per loop')
+
+        program_fn, _ = compile_program(tuple(self.program))
+        _, reg_b, reg_c = self._orig_reg
+
+        def search(reg_a, matched):
+            if matched == len(self.program):
+                return reg_a
+            expected = self.program[-(matched + 1):]
+            for digit in range(8):
+                candidate = reg_a * 8 + digit
+                # A = 0 would stop the loop before it outputs anything else
+                if not candidate:
+                    continue
+                if program_fn(candidate, reg_b, reg_c, 0, expected)[4] == expected:
+                    res = search(candidate, matched + 1)
+                    if res is not None:
+                        return res
+            return None
+
+        reg_a = search(0, 0)
+        if reg_a is None:
+            return None
+
+        # double check with the interpreter
+        check = Computer(reg_a, reg_b, reg_c, self.program)
+        check.run()
+        if check.output != self.program:
+            raise ValueError(f'reg_a {reg_a} did not reproduce the program')
+        return reg_a
+
     def reset(self):
         self.ptr = 0
         self.steps_taken = 0
         self.output = []
         self.reg_a, self.reg_b, self.reg_c = self._orig_reg
+        self.reset_history()
 
     def get_program(self):
         combo_map = {
@@ -463,6 +688,282 @@ class Computer(object):
     def add_output(self, out):
         self.output.append(out)
 
+COMBO_SOURCE = {
+    0: '0',
+    1: '1',
+    2: '2',
+    3: '3',
+    4: 'reg_a',
+    5: 'reg_b',
+    6: 'reg_c'
+}
+
+@cache
+def compile_program(program: tuple[int]):
+    """
+    Translates a program into Python source and compiles it. Returns (fn, leaders), where leaders are the
+    instruction pointers a basic block starts at and fn(reg_a, reg_b, reg_c, ptr, expected=None) runs from
+    one of them until the program halts, or until an output doesn't match expected, returning (reg_a, reg_b,
+    reg_c, ptr, output, steps). Operands are resolved here, once, so running the program does no decoding at
+    all.
+    """
+    # find every reachable instruction, and where blocks start: the entry point, jump targets, and the
+    # instruction after each jump
+    leaders = {0}
+    reachable = set()
+    todo = [0]
+    while todo:
+        ptr = todo.pop()
+        if ptr in reachable or ptr >= len(program):
+            continue
+        reachable.add(ptr)
+        if ptr + 1 == len(program):
+            continue
+        if program[ptr] == 3:
+            leaders.update([program[ptr + 1], ptr + 2])
+            todo.extend([program[ptr + 1], ptr + 2])
+        else:
+            todo.append(ptr + 2)
+
+    lines = [
+        'def run_program(reg_a, reg_b, reg_c, ptr, expected=None):',
+        '    output = []',
+        '    steps = 0',
+        '    while True:',
+    ]
+    for leader in sorted(leaders):
+        if leader not in reachable:
+            continue
+        lines.append(f'        if ptr == {leader}:')
+        ptr = leader
+        block_len = 0
+        while True:
+            if ptr != leader and ptr in leaders:
+                lines.append(f'            steps += {block_len}')
+                lines.append(f'            ptr = {ptr}')
+                lines.append('            continue')
+                break
+            if ptr >= len(program):
+                lines.append(f'            steps += {block_len}')
+                lines.append(f'            return reg_a, reg_b, reg_c, {ptr}, output, steps')
+                break
+            if ptr + 1 == len(program):
+                # the interpreter can't read an operand here either
+                lines.append("            raise IndexError('instruction is missing its operand')")
+                break
+
+            op, arg = program[ptr], program[ptr + 1]
+            block_len += 1
+            if op in (0, 2, 5, 6, 7) and arg not in COMBO_SOURCE:
+                lines.append("            raise ValueError('tried to decode an arg of 7')")
+                break
+            combo = COMBO_SOURCE.get(arg)
+
+            match op:
+                # adv (division)
+                case 0:
+                    lines.append(f'            reg_a = reg_a // (2 ** {combo})')
+                # bxl (bitwise XOR)
+                case 1:
+                    lines.append(f'            reg_b = reg_b ^ {arg}')
+                # bst (modulo 8)
+                case 2:
+                    lines.append(f'            reg_b = {combo} % 8')
+                # jnz (jump not zero)
+                case 3:
+                    lines.append(f'            steps += {block_len}')
+                    lines.append('            if reg_a != 0:')
+                    lines.append(f'                ptr = {arg}')
+                    lines.append('                continue')
+                    lines.append(f'            ptr = {ptr + 2}')
+                    lines.append('            continue')
+                    break
+                # bxc (bitwise XOR)
+                case 4:
+                    lines.append('            reg_b = reg_b ^ reg_c')
+                # out (output)
+                case 5:
+                    lines.append(f'            output.append({combo} % 8)')
+                    lines.append('            if expected is not None and (len(output) > len(expected) '
+                                 'or output[-1] != expected[len(output) - 1]):')
+                    lines.append(f'                return reg_a, reg_b, reg_c, {ptr + 2}, output, steps + {block_len}')
+                # bdv (division)
+                case 6:
+                    lines.append(f'            reg_b = reg_a // (2 ** {combo})')
+                # cdv (division)
+                case 7:
+                    lines.append(f'            reg_c = reg_a // (2 ** {combo})')
+                case _:
+                    raise Exception("no match")
+            ptr += 2
+
+    # jumping anywhere else means jumping past the end of the program
+    lines.append('        return reg_a, reg_b, reg_c, ptr, output, steps')
+
+    namespace = {}
+    exec(compile('\n'.join(lines), '<day17 program>', 'exec'), namespace)
+    return namespace['run_program'], frozenset(leaders)
+
+def run_batch(program, reg_a, reg_b=0, reg_c=0, max_steps=100_000, max_output=None):
+    """
+    Runs a program over many register triples at once, one lane per entry of reg_a (reg_b and reg_c can be
+    arrays or a single value for every lane). Lanes step in lockstep as numpy vector ops, and each jnz
+    splits them up by where they jump. Registers are int64 and have to be non-negative.
+
+    Returns (output, output_len, halted): an (n, max_output) array of each lane's first max_output
+    outputs padded with -1 (max_output defaults to the program length), how many values each lane output
+    in total, and whether each lane halted within max_steps.
+    """
+    if np is None:
+        raise ImportError('run_batch needs numpy')
+    if max_output is None:
+        max_output = len(program)
+
+    reg_a = np.array(reg_a, dtype=np.int64).ravel()
+    lane_count = len(reg_a)
+    regs = {
+        'reg_a': reg_a,
+        'reg_b': np.broadcast_to(np.asarray(reg_b, dtype=np.int64), lane_count).copy(),
+        'reg_c': np.broadcast_to(np.asarray(reg_c, dtype=np.int64), lane_count).copy(),
+    }
+    output = np.full((lane_count, max_output), -1, dtype=np.int8)
+
+    jnz_ptrs = [ptr for ptr in range(0, len(program) - 1, 2) if program[ptr] == 3]
+    if len(program) % 2 == 0 and jnz_ptrs in ([], [len(program) - 2]) and program[-1] % 2 == 0:
+        output_len, halted = _run_batch_single_loop(program, regs, output, max_steps)
+    else:
+        output_len, halted = _run_batch_branching(program, regs, output, max_steps)
+    return output, output_len, halted
+
+def _run_batch_single_loop(program, regs, output, max_steps):
+    """
+    run_batch for programs whose only jnz is the last instruction, like the puzzle's. Lanes only ever leave
+    the loop by falling through that jnz, which halts them, so every lane that's still running is at the
+    same instruction. That means one shared ptr, and no regrouping of the lanes at every step.
+    """
+    max_output = output.shape[1]
+    lanes = np.arange(len(regs['reg_a']))
+    output_len = np.zeros(len(lanes), dtype=np.int64)
+    halted = np.zeros(len(lanes), dtype=bool)
+    ptr = 0
+    out_count = 0
+
+    def decode(arg):
+        if arg not in COMBO_SOURCE:
+            raise ValueError('tried to decode an arg of 7')
+        if arg < 4:
+            return arg
+        return regs[COMBO_SOURCE[arg]]
+
+    for _ in range(max_steps):
+        if ptr >= len(program) or not len(lanes):
+            break
+        op, arg = program[ptr], program[ptr + 1]
+        ptr += 2
+
+        match op:
+            # adv, bdv, cdv (division): shifting by 63 already clears any non-negative int64
+            case 0 | 6 | 7:
+                dest = {0: 'reg_a', 6: 'reg_b', 7: 'reg_c'}[op]
+                regs[dest] = regs['reg_a'] >> np.minimum(decode(arg), 63)
+
+            # bxl (bitwise XOR)
+            case 1:
+                regs['reg_b'] = regs['reg_b'] ^ arg
+
+            # bst (modulo 8)
+            case 2:
+                regs['reg_b'] = np.broadcast_to(decode(arg) % 8, len(lanes)).copy()
+
+            # jnz (jump not zero): lanes with A at 0 fall off the end of the program, so drop them
+            case 3:
+                jumps = regs['reg_a'] != 0
+                if not jumps.all():
+                    done = lanes[~jumps]
+                    halted[done] = True
+                    output_len[done] = out_count
+                    lanes = lanes[jumps]
+                    regs = {name: reg[jumps] for name, reg in regs.items()}
+                ptr = arg
+
+            # bxc (bitwise XOR)
+            case 4:
+                regs['reg_b'] = regs['reg_b'] ^ regs['reg_c']
+
+            # out (output)
+            case 5:
+                if out_count < max_output:
+                    output[lanes, out_count] = decode(arg) % 8
+                out_count += 1
+
+    output_len[lanes] = out_count
+    halted[lanes] = ptr >= len(program)
+    return output_len, halted
+
+def _run_batch_branching(program, regs, output, max_steps):
+    """
+    run_batch for any other program: lanes get grouped by ptr at every step, and each group runs its own
+    instruction.
+    """
+    lane_count = len(regs['reg_a'])
+    max_output = output.shape[1]
+    ptr = np.zeros(lane_count, dtype=np.int64)
+    output_len = np.zeros(lane_count, dtype=np.int64)
+
+    def decode(arg, lanes):
+        if arg not in COMBO_SOURCE:
+            raise ValueError('tried to decode an arg of 7')
+        if arg < 4:
+            return arg
+        return regs[COMBO_SOURCE[arg]][lanes]
+
+    for _ in range(max_steps):
+        # group by where the lanes were at the start of the step, so a lane that just moved doesn't get to
+        # run again in the same step
+        cur = ptr.copy()
+        # a lane with only an opcode left can't run either, same as the interpreter
+        running = np.flatnonzero(cur + 1 < len(program))
+        if not len(running):
+            break
+
+        for cur_ptr in np.unique(cur[running]):
+            lanes = running[cur[running] == cur_ptr]
+            op, arg = program[cur_ptr], program[cur_ptr + 1]
+            ptr[lanes] = cur_ptr + 2
+
+            match op:
+                # adv, bdv, cdv (division): shifting by 63 already clears any non-negative int64
+                case 0 | 6 | 7:
+                    dest = {0: 'reg_a', 6: 'reg_b', 7: 'reg_c'}[op]
+                    regs[dest][lanes] = regs['reg_a'][lanes] >> np.minimum(decode(arg, lanes), 63)
+
+                # bxl (bitwise XOR)
+                case 1:
+                    regs['reg_b'][lanes] ^= arg
+
+                # bst (modulo 8)
+                case 2:
+                    regs['reg_b'][lanes] = decode(arg, lanes) % 8
+
+                # jnz (jump not zero)
+                case 3:
+                    ptr[lanes] = np.where(regs['reg_a'][lanes] != 0, arg, cur_ptr + 2)
+
+                # bxc (bitwise XOR)
+                case 4:
+                    regs['reg_b'][lanes] ^= regs['reg_c'][lanes]
+
+                # out (output)
+                case 5:
+                    vals = np.broadcast_to(decode(arg, lanes) % 8, len(lanes))
+                    slots = output_len[lanes]
+                    fits = slots < max_output
+                    output[lanes[fits], slots[fits]] = vals[fits]
+                    output_len[lanes] += 1
+
+    halted = ptr >= len(program)
+    return output_len, halted
+
 def main():
     comp = None
     with open('input/day17_input.txt') as f: